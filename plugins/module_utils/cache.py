@@ -0,0 +1,133 @@
+# Class to remember the results of middleware calls between tasks.
+#
+# Each Ansible task runs in a fresh process on the TrueNAS host, so
+# anything worth remembering from one task to the next has to be
+# written to disk. This is a very simple cache: each entry is a JSON
+# file, and an entry expires when its file is older than the cache's
+# TTL.
+#
+# Caching can be turned off entirely by setting the environment
+# variable 'truenas_cache' to "no", e.g.:
+#
+# - hosts: my-nas
+#   collections: arensb.truenas
+#   environment:
+#     truenas_cache: no
+#   tasks:
+#     ...
+
+__metaclass__ = type
+"""
+This module implements a simple on-disk cache.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+
+CACHE_DIR = os.path.expanduser("~/.ansible/tmp/truenas_cache")
+
+
+class FileCache:
+    def __init__(self, name, ttl=30):
+        """Create a cache entry called 'name', which expires after
+        'ttl' seconds.
+
+        'name' can be any string: the file name is a readable version
+        of it, with a hash of the real name appended, so that
+        different names never share a file.
+        """
+
+        self.ttl = ttl
+        digest = hashlib.sha256(name.encode()).hexdigest()[:16]
+        self.path = os.path.join(CACHE_DIR,
+                                 f"{FileCache._safe_name(name)}-{digest}.json")
+
+    @staticmethod
+    def _safe_name(name):
+        """Return a version of 'name' that can be used in a file name:
+        any characters other than letters, digits, '.', '-', and '_'
+        are replaced, and it's cut down to a reasonable length.
+        """
+        return re.sub(r'[^\w.-]', '_', name)[:64]
+
+    @staticmethod
+    def enabled():
+        """Return true iff caching is turned on."""
+        return os.getenv('truenas_cache', 'yes').lower() not in \
+            ('no', 'false', 'off', '0')
+
+    def get(self):
+        """Return the cached value, or None if there isn't one, or if
+        it has expired.
+        """
+
+        if not FileCache.enabled():
+            return None
+
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.ttl:
+                # Expired. Don't leave stale data lying around.
+                self.invalidate()
+                return None
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # No cache file, or we can't read it. Either way, it's a
+            # miss.
+            return None
+
+    def set(self, value):
+        """Store 'value' in the cache. 'value' must be serializable as
+        JSON.
+
+        Errors are ignored: failing to write the cache is not a
+        reason to fail the task.
+        """
+
+        if not FileCache.enabled():
+            return
+
+        # Write to a temporary file, then rename it, so that nobody
+        # ever sees a partially-written cache file. Some of what gets
+        # cached, like the mail configuration, includes passwords, so
+        # only the owner gets to read it.
+        tmp = f"{self.path}.{os.getpid()}"
+        try:
+            os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp, self.path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def invalidate(self):
+        """Remove the cached value, if any."""
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def invalidate_prefix(prefix):
+        """Remove every cached value whose name starts with 'prefix'.
+
+        This may remove a few more entries than strictly necessary,
+        but never fewer.
+        """
+
+        pattern = os.path.join(CACHE_DIR,
+                               glob.escape(FileCache._safe_name(prefix)) + "*")
+        for path in glob.glob(pattern):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
@@ -7,22 +7,45 @@ This module interfaces with middlewared on TrueNAS, and tries to do so
 natively.
 """
 
+import atexit
+import threading
 import middlewared.client as client
 
 
 class MiddlewareClient:
     client = None
 
+    # Several threads may make calls at the same time (see
+    # middleware.call_multi()), so make sure only one of them creates
+    # the connection.
+    _lock = threading.Lock()
+
     @staticmethod
     def _client():
         """
         Singleton. Return a middleware client handle, creating one if
         necessary.
+
+        The connection is reused for all calls made by this process,
+        and closed when the process exits.
         """
-        if MiddlewareClient.client is None:
-            MiddlewareClient.client = client.Client()
+        with MiddlewareClient._lock:
+            if MiddlewareClient.client is None:
+                MiddlewareClient.client = client.Client()
+                atexit.register(MiddlewareClient._close)
         return MiddlewareClient.client
 
+    @staticmethod
+    def _close():
+        """Close the connection to the middleware, if there is one."""
+        if MiddlewareClient.client is not None:
+            try:
+                MiddlewareClient.client.close()
+            except Exception:
+                # We're exiting anyway.
+                pass
+            MiddlewareClient.client = None
+
     @staticmethod
     def call(func, *args, output=None):
         """Call the API function 'func' with arguments 'args'.
@@ -0,0 +1,17 @@
+# Things that the jail-related modules have in common.
+
+__metaclass__ = type
+"""
+This module holds definitions shared by the jail modules.
+"""
+
+import re
+
+# What a valid jail name looks like: letters, digits, and a few
+# punctuation characters, up to 128 characters.
+JAIL_NAME_RE = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.\-]{0,127}")
+
+
+def valid_jail_name(name):
+    """Return true iff 'name' is a valid jail name."""
+    return name is not None and JAIL_NAME_RE.fullmatch(name) is not None
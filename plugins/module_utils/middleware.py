@@ -8,13 +8,29 @@
 # sits between individual modules and the middleware, and uses
 # whichever access method is chosen.
 
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ansible_collections.arensb.truenas.plugins.module_utils.cache \
+    import FileCache
+
+# How long to cache the results of cached_call(), in seconds, by
+# default.
+CACHED_CALL_TTL = 30
 
 # XXX - Ought to define an exception type for things that can go wrong
 # with middleware calls.
 
 
 class MiddleWare:
+    # The client returned by client(). There's no point in having
+    # more than one per process.
+    _instance = None
+
+    # Make sure only one thread creates it.
+    _lock = threading.Lock()
+
     def __init__(self):
         """Initialize the MiddleWare client.
 
@@ -70,7 +86,91 @@ class MiddleWare:
 
     @classmethod
     def client(cls):
-        """Return a client for interfacing with middlewared."""
-        client_class = MiddleWare._pick_method()
+        """Return a client for interfacing with middlewared.
+
+        The same client is returned every time. Each Ansible task runs
+        in a separate process, so this doesn't carry over from one
+        task to the next, but it means that helpers that need a client
+        don't each pick a method and build a new one.
+        """
+        with MiddleWare._lock:
+            if MiddleWare._instance is None:
+                client_class = MiddleWare._pick_method()
+                MiddleWare._instance = client_class()
+
+        return MiddleWare._instance
+
+
+def call_multi(client, calls, job=False, ttl=None):
+    """Make several independent middleware calls concurrently.
+
+    'client' is a client, as returned by MiddleWare.client().
+
+    'calls' is a list of tuples of the form (func, args) or
+    (func, args, kwargs), where 'args' is a list of arguments and
+    'kwargs' a dict of keyword arguments to pass to client.call().
+
+    If 'job' is true, the calls are made with client.job() instead.
+
+    If 'ttl' is given, each call goes through cached_call() with that
+    TTL, so only the calls whose results aren't cached are actually
+    made. In this case, the calls can't have keyword arguments.
+
+    Returns a list of results, in the same order as 'calls'. If a call
+    raised an exception, the exception is returned in its place, so
+    that the caller can decide which errors matter, and in what order
+    to report them.
+    """
+
+    if ttl is None:
+        method = client.job if job else client.call
+    else:
+        def method(func, *args):
+            return cached_call(client, func, *args, ttl=ttl, job=job)
+
+    with ThreadPoolExecutor(max_workers=max(len(calls), 1)) as executor:
+        futures = [executor.submit(method, c[0], *c[1],
+                                   **(c[2] if len(c) > 2 else {}))
+                   for c in calls]
+
+    retval = []
+    for future in futures:
+        err = future.exception()
+        retval.append(err if err is not None else future.result())
+    return retval
+
+
+def _call_cache(func, args, ttl=CACHED_CALL_TTL):
+    """Return the FileCache that holds the result of func(*args)."""
+    name = f"call-{func}"
+    if args:
+        name += "-" + json.dumps(args, sort_keys=True)
+    return FileCache(name, ttl=ttl)
+
+
+def cached_call(client, func, *args, ttl=CACHED_CALL_TTL, job=False):
+    """Call client.call(func, *args), but reuse the result of an
+    earlier call, from this task or an earlier one, if it is less
+    than 'ttl' seconds old.
+
+    If 'job' is true, the call is made with client.job() instead.
+
+    This is only for methods that look things up without changing
+    anything, like "mail.config". Whoever changes the underlying
+    configuration should call invalidate_call() afterward.
+    """
+
+    cache = _call_cache(func, args, ttl=ttl)
+    retval = cache.get()
+    if retval is None:
+        method = client.job if job else client.call
+        retval = method(func, *args)
+        cache.set(retval)
+    return retval
+
 
-        return client_class()
+def invalidate_call(func, *args):
+    """Forget the cached result of func(*args), if any, so that the
+    next cached_call() asks the middleware again.
+    """
+    _call_cache(func, args).invalidate()
@@ -69,6 +69,19 @@ options:
       - Name of FreeBSD release to base this jail on.
       - Required when creating a jail.
     type: str
+  skip_existence_check:
+    description:
+      - If true, and C(state) is C(restarted), assume that the jail
+        exists and restart it without looking it up first. This saves
+        a middleware call when you know the jail is there.
+      - If the restart fails, the jail is looked up as usual, and will
+        be created if it does not exist.
+      - In check mode, the jail is not looked up at all, unless
+        C(state) is C(absent). Only a restart is reported as a change.
+      - Has no other effect for other values of C(state).
+    type: bool
+    default: false
+    aliases: [ assume_exists ]
   state:
     description:
       - Whether the jail should exist or not.
@@ -95,12 +108,81 @@ jail:
     - An object containing a description of a newly-created jail.
       The format is the same as that returned by the C(jail.query)
       middleware call.
+    - If the jail was started after being created, C(state) reflects
+      that.
   type: dict
 '''
 
+import fcntl
+import signal
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.arensb.truenas.plugins.module_utils.middleware \
     import MiddleWare as MW
+from ansible_collections.arensb.truenas.plugins.module_utils.cache \
+    import FileCache
+from ansible_collections.arensb.truenas.plugins.module_utils.jail \
+    import valid_jail_name
+
+# Directory where per-jail lock files go.
+LOCK_DIR = "/var/run"
+
+# How long to wait for another task to finish with a jail, in
+# seconds. Creating a jail fetches a release and installs packages,
+# which can take a long time.
+LOCK_TIMEOUT = 60 * 60
+
+# Jail locks that this process holds. The lock is released when its
+# file is closed, so keep the files here, open, until the module
+# exits.
+_held_locks = []
+
+# Allowed values for the 'state' option.
+_STATE_CHOICES = ('absent', 'present', 'restarted', 'running', 'stopped')
+
+# Module arguments. These never change, so build them once.
+_ARGSPEC = dict(
+    name=dict(type='str', required=True),
+    state=dict(type='str', default='present',
+               choices=_STATE_CHOICES),
+    release=dict(type='str'),
+    packages=dict(type='list', elements='str', aliases=['pkglist']),
+    skip_existence_check=dict(type='bool', default=False,
+                              aliases=['assume_exists']),
+)
+
+
+def _jail_lock(name, ttl=LOCK_TIMEOUT):
+    """Take an exclusive lock on the jail 'name'.
+
+    If several tasks try to change the same jail at the same time, we
+    want them to take turns, so that each one sees what the previous
+    one did, rather than all of them trying to create or start the
+    same jail.
+
+    Wait up to 'ttl' seconds for the lock, then raise TimeoutError.
+    The lock file is kept open in _held_locks, so the lock is held
+    until the process exits.
+    """
+
+    def on_timeout(signum, frame):
+        raise TimeoutError(f"Timed out waiting for lock on jail {name}")
+
+    lockfile = open(f"{LOCK_DIR}/ansible-truenas-jail-{name}.lock", "w")
+
+    # Block until we get the lock, but have SIGALRM interrupt the
+    # wait if it takes too long.
+    old_handler = signal.signal(signal.SIGALRM, on_timeout)
+    signal.alarm(ttl)
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+    except BaseException:
+        lockfile.close()
+        raise
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+    _held_locks.append(lockfile)
 
 
 def main():
@@ -147,14 +229,7 @@ def main():
     # - plugin (bool)
 
     module = AnsibleModule(
-        argument_spec=dict(
-            name=dict(type='str'),
-            state=dict(type='str', default='present',
-                       choices=['absent', 'present', 'restarted',
-                                'running', 'stopped']),
-            release=dict(type='str'),
-            packages=dict(type='list', elements='str', aliases=['pkglist']),
-            ),
+        argument_spec=_ARGSPEC,
         supports_check_mode=True,
     )
 
@@ -163,6 +238,10 @@ def main():
         msg=''
     )
 
+    # Messages about what would have been done in check mode. These
+    # are joined into result['msg'] at the end.
+    msgs = []
+
     mw = MW.client()
 
     # Assign variables from properties, for convenience
@@ -170,6 +249,61 @@ def main():
     state = module.params['state']
     release = module.params['release']
     packages = module.params['packages']
+    skip_existence_check = module.params['skip_existence_check']
+
+    # The name is used in the lock file's path, so make sure it's
+    # sane before going any further.
+    if not valid_jail_name(name):
+        module.fail_json(msg=f"Invalid jail name: {name!r}")
+
+    # Make sure no one else is changing this jail at the same time.
+    # Check mode doesn't change anything, so it doesn't need a lock.
+    # The lock is held until the module exits. If we had to wait for
+    # it, that's fine: the jail is looked up below, after the lock is
+    # acquired, so we'll see whatever changes the previous holder
+    # made, and won't redo them.
+    if not module.check_mode:
+        try:
+            _jail_lock(name)
+        except Exception as e:
+            # This includes timing out: whoever has the lock is taking
+            # an awfully long time, and it's not safe to barge in.
+            module.fail_json(msg=f"Error locking jail {name}: {e}")
+
+    if skip_existence_check and module.check_mode and state != 'absent':
+        # The caller has promised that the jail exists. In check mode,
+        # we're not going to change anything, so there's no point in
+        # looking it up.
+        if state == 'restarted':
+            result['msg'] = f"Would have restarted jail {name}"
+            result['changed'] = True
+        else:
+            result['msg'] = f"Would have ensured jail {name} is {state}"
+        module.exit_json(**result)
+
+    if skip_existence_check and state == 'restarted':
+        # The caller has promised that the jail exists, so don't
+        # bother looking it up: just restart it.
+        try:
+            err = mw.job("jail.restart", name)
+        except Exception as e:
+            # The caller may have been wrong, and the jail doesn't
+            # exist. In that case, fall through to the normal path,
+            # which will look it up and create it. But if it does
+            # exist, the restart really failed, and doing it again
+            # won't help.
+            try:
+                exists = len(mw.call("jail.query",
+                                     [["id", "=", name]],
+                                     {"select": ["id"], "limit": 1})) > 0
+            except Exception:
+                exists = True
+            if exists:
+                module.fail_json(msg=f"Error restarting jail {name}: {e}")
+        else:
+            result['status'] = err
+            result['changed'] = True
+            module.exit_json(**result)
 
     # Look up the jail
 
@@ -178,8 +312,14 @@ def main():
     # Maybe add a 'pool' argument to specify whcih pool to check?
 
     try:
+        # We only care about the state, so don't fetch the whole
+        # jail description.
+        #
+        # Note: not using the "get" option, because then a missing
+        # jail looks just like any other error.
         jail_info = mw.call("jail.query",
-                            [["id", "=", name]])
+                            [["id", "=", name]],
+                            {"select": ["id", "state"], "limit": 1})
         if len(jail_info) == 0:
             # No such jail
             jail_info = None
@@ -209,7 +349,10 @@ def main():
             #     arg['feature'] = feature
 
             if packages is not None:
-                arg['pkglist'] = packages
+                # jail.create() installs the whole list with a single
+                # 'pkg install', so just make sure we don't ask for
+                # the same package twice.
+                arg['pkglist'] = sorted(set(packages))
 
             if module.check_mode:
                 result['msg'] = f"Would have created jail {name} with {arg}"
@@ -217,6 +360,9 @@ def main():
                 #
                 # Create new jail
                 #
+                # Anything jail_fstab cached about an earlier jail of
+                # the same name no longer applies.
+                FileCache(f"jail_fstab-{name}").invalidate()
                 try:
                     err = mw.job("jail.create", arg)
                 except Exception as e:
@@ -242,6 +388,12 @@ def main():
                         err = mw.job("jail.start", name)
                     except Exception as e:
                         module.fail_json(msg=f"Error starting jail {name}: {e}")
+
+                    # The jail description we got from jail.create()
+                    # says the jail is down. Rather than look it up
+                    # again, just update it to reflect reality.
+                    if isinstance(result['jail'], dict):
+                        result['jail']['state'] = "up"
                 result['status'] = err
 
             result['changed'] = True
@@ -260,7 +412,7 @@ def main():
                 # Stop the jail.
                 #
                 if module.check_mode:
-                    result['msg'] += f"Would have stopped jail {name}."
+                    msgs.append(f"Would have stopped jail {name}.")
                 else:
                     try:
                         err = mw.job("jail.stop", name)
@@ -269,7 +421,7 @@ def main():
                     result['status_stop'] = err
 
             if module.check_mode:
-                result['msg'] += f"Would have deleted jail {name}."
+                msgs.append(f"Would have deleted jail {name}.")
             else:
                 try:
                     #
@@ -278,7 +430,9 @@ def main():
                     err = mw.call("jail.delete", name)
                 except Exception as e:
                     module.fail_json(msg=f"Error deleting jail {name}: {e}")
+                FileCache(f"jail_fstab-{name}").invalidate()
             result['changed'] = True
+            result['msg'] = " ".join(msgs)
             module.exit_json(**result)
 
         # The jail exists. Check whether its configuration needs to be
@@ -304,7 +458,7 @@ def main():
             # Update jail.
             #
             if module.check_mode:
-                result['msg'] += f"Would have updated jail {name}: {arg}"
+                msgs.append(f"Would have updated jail {name}: {arg}")
             else:
                 try:
                     err = mw.call("jail.update", name,
@@ -326,7 +480,7 @@ def main():
                 # We want it to be running, but it's not.
                 # Start it.
                 if module.check_mode:
-                    result['msg'] += f"Would have started jail {name}"
+                    msgs.append(f"Would have started jail {name}")
                 else:
                     try:
                         err = mw.job("jail.start", name)
@@ -339,7 +493,7 @@ def main():
                 # We want it to be stopped, but it's up.
                 # Stop it.
                 if module.check_mode:
-                    result['msg'] += f"Would have stopped jail {name}"
+                    msgs.append(f"Would have stopped jail {name}")
                 else:
                     try:
                         err = mw.job("jail.stop", name)
@@ -356,7 +510,7 @@ def main():
             # The jail exists, but may be either up or down.
             # Either way, restart it.
             if module.check_mode:
-                result['msg'] += f"Would have restarted jail {name}"
+                msgs.append(f"Would have restarted jail {name}")
             else:
                 try:
                     err = mw.job("jail.restart", name)
@@ -365,6 +519,8 @@ def main():
                 result['status'] = err
             result['changed'] = True
 
+    if len(msgs) > 0:
+        result['msg'] = " ".join(msgs)
     module.exit_json(**result)
 
 
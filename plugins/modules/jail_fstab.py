@@ -15,6 +15,10 @@ description:
   - 'If you do not want production jails to be restarted without your
     explicit approval, you can add a clause like
     C(check_mode: "{{ restart_jails != ''yes'' }}")'
+  - To save time, the location of the iocage root, and each jail's
+    fstab, are cached on the TrueNAS host between tasks. The fstab is
+    only cached for a few seconds. Set the environment variable
+    C(truenas_cache) to C(no) to turn this off.
 options:
   append:
     description:
@@ -28,6 +32,16 @@ options:
       - Name of the jail
     type: str
     required: yes
+  iocroot:
+    description:
+      - The root of the iocage directory tree, typically
+        C(/mnt/<pool>/iocage).
+      - If given, the module uses this instead of asking the middleware
+        for it. The C(truenas_facts) module sets the
+        C(truenas_iocroot) fact, which can be used here.
+      - If not given, and exactly one pool has an C(iocage) directory,
+        that one is used. Otherwise, the module asks the middleware.
+    type: str
   fstab:
     description:
       - List of mount points. Each element is a dictionary.
@@ -120,6 +134,14 @@ EXAMPLES = '''
         mount: /my-data
   check_mode: "{{ ansible_check_mode or bounce_jails != 'yes' }}"
 
+- name: Use the iocage root from truenas_facts instead of looking it up
+  arensb.truenas.jail_fstab:
+    jail: the-jail-name
+    iocroot: "{{ ansible_facts.truenas_iocroot }}"
+    fstab:
+      - src: /mnt/data/my-data
+        mount: /my-data
+
 - name: Ensure that a filesystem is *not* mounted:
   arensb.truenas.jail_fstab:
     jail: the-jail-name
@@ -161,83 +183,83 @@ status:
   type: list
 '''
 
+import glob
+import os
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.arensb.truenas.plugins.module_utils.middleware \
-    import MiddleWare as MW
-
-
-def main():
-    module = AnsibleModule(
-        argument_spec=dict(
-            jail=dict(type='str', required=True),
-            fstab=dict(type='list', required=True,
-                       elements='dict',
-                       options=dict(
-                           src=dict(type='str'),
-                           mount=dict(type='str', required=True),
-                           fstype=dict(type='str', default="nullfs"),
-                           options=dict(type='str', default="ro"),
-                           dump=dict(type='int', default=0),
-                           fsck_pass=dict(type='int', default=0),
-                           state=dict(type='str', default='present',
-                                      choices=['present', 'absent'])
-                       ),
-                       required_if=[
-                           ('state', 'present', ('src', 'mount'))
-                       ]
-                       ),
-            append=dict(type='bool', default=False),
-            ),
-        supports_check_mode=True,
-    )
-
-    result = dict(
-        changed=False,
-        msg='',
-        status=[]
-    )
-    if module.check_mode:
-        # List of changes being made
-        result['changes'] = []
-
-    mw = MW.client()
-
-    # Assign variables from properties, for convenience
-    jail = module.params['jail']
-    fstab = module.params['fstab']
-    append = module.params['append']
-
-    # Look up the jail and its fstab
-    try:
-        jail_info = mw.call("jail.query",
-                            [["id", "=", jail]],
-                            # We only care about state for now.
-                            {"select": ["state"]})
-
-        if len(jail_info) == 0:
-            # No such jail
-            module.fail_json(msg=f"No such jail {jail}")
-        else:
-            # Jail exists
-            jail_info = jail_info[0]
-
-        fstab_info = mw.call("jail.fstab",
-                             jail,
-                             {"action": "LIST"})
-    except Exception as e:
-        module.fail_json(msg=f"Error looking up jail {jail}: {e}")
-
-    # Filter out the "SYSTEM" entries and only keep the "USER" ones.
-    fstab_info = {k: v for (k, v) in fstab_info.items()
-                  if v['type'] == "USER"}
-    result['fstab'] = fstab_info
-
-    # Get the root of the jail. We're going to need it in a second.
-    try:
-        iocroot = mw.call("jail.get_iocroot", output='str')
-    except Exception as e:
-        module.fail_json(msg=f"Error looking up iocroot: {e}")
-    jail_root = f"{iocroot}/jails/{jail}/root"
+    import MiddleWare as MW, call_multi
+from ansible_collections.arensb.truenas.plugins.module_utils.cache \
+    import FileCache
+from ansible_collections.arensb.truenas.plugins.module_utils.jail \
+    import valid_jail_name
+
+# How long to cache the iocage root, in seconds. This practically
+# never changes.
+IOCROOT_TTL = 6 * 60 * 60
+
+# How long to cache a jail's fstab, in seconds. This module
+# invalidates the cache whenever it changes the fstab, but someone
+# else might change it, so keep this short.
+FSTAB_TTL = 30
+
+# Optional fields for jail.fstab("ADD"): maps the names of 'fstab'
+# suboptions to the names of jail.fstab() arguments.
+ADD_FIELDS = (
+    ("fstype", "fstype"),
+    ("options", "fsoptions"),
+    ("dump", "dump"),
+    ("fsck_pass", "pass"),
+)
+
+# Order in which to apply the different kinds of jail.fstab() changes.
+ACTION_ORDER = {"REPLACE": 0, "REMOVE": 1, "ADD": 2}
+
+# Options for each element of 'fstab'.
+_FSTAB_OPTIONS = dict(
+    src=dict(type='str'),
+    mount=dict(type='str', required=True),
+    fstype=dict(type='str', default="nullfs"),
+    options=dict(type='str', default="ro"),
+    dump=dict(type='int', default=0),
+    fsck_pass=dict(type='int', default=0),
+    state=dict(type='str', default='present',
+               choices=['present', 'absent'])
+)
+
+# Module arguments. These never change, so build them once.
+_ARGSPEC = dict(
+    jail=dict(type='str', required=True),
+    fstab=dict(type='list', required=True,
+               elements='dict',
+               options=_FSTAB_OPTIONS,
+               required_if=[
+                   ('state', 'present', ('src', 'mount'))
+               ]
+               ),
+    append=dict(type='bool', default=False),
+    iocroot=dict(type='str'),
+)
+
+
+def _no_such_method(e):
+    """Return true iff the exception 'e' says that the middleware
+    doesn't know about the method that was called (core.bulk), as
+    opposed to the method failing.
+    """
+    msg = str(e)
+    return "bulk" in msg and ("not found" in msg or "does not exist" in msg)
+
+
+def plan_changes(fstab_info, fstab, append, jail_root):
+    """Compare the jail's fstab, as returned by jail.fstab("LIST"),
+    with 'fstab', the list of entries the caller wants, and work out
+    what needs to change.
+
+    Returns a tuple (user_fstab, change_args):
+    'user_fstab' is the USER part of fstab_info, as is;
+    'change_args' is the list of arguments to pass to jail.fstab(),
+    in the order in which to apply them.
+    """
 
     # fstab_info is in the form returned by jail.fstab("LIST"). This
     # has two problems:
@@ -261,18 +283,48 @@ def main():
     # the jail: "/data".
     #
     # So before going any further, let's rewrite fstab_info in object
-    # form.
-    fstab_info = [{
-        "index": k,
-        "source": v['entry'][0],
-        "destination": v['entry'][1],
+    # form. While we're at it, convert dump and pass to integers, so
+    # they can be compared directly to the module parameters.
+    #
+    # "source" and "mount" are kept exactly as written in the file,
+    # since that's how REMOVE and REPLACE identify the line.
+    # "source_key" and "mount_key" are normalized versions, used only
+    # to compare against 'fstab', so that "/data/" and "/data" match.
+    #
+    # We only care about the "USER" entries, not the "SYSTEM" ones, so
+    # filter those out in the same pass. The caller gets the USER
+    # entries in their original form.
+    #
+    # Strip the jail root by hand rather than with str.removeprefix(),
+    # which requires Python 3.9.
+    prefix_len = len(jail_root)
+    user_fstab = {}
+    user_entries = []
+    for (k, v) in fstab_info.items():
+        if v['type'] != "USER":
+            continue
+        user_fstab[k] = v
+        destination = v['entry'][1]
         # "mount" is the mount point, relative to the jail.
-        "mount": v['entry'][1].removeprefix(jail_root),
-        "fstype": v['entry'][2],
-        "fsoptions": v['entry'][3],
-        "dump": v['entry'][4],
-        "pass": v['entry'][5],
-    } for (k, v) in fstab_info.items()]
+        mount = destination[prefix_len:] \
+            if destination.startswith(jail_root) else destination
+        user_entries.append({
+            "index": k,
+            "source": v['entry'][0],
+            "source_key": os.path.normpath(v['entry'][0]),
+            "destination": destination,
+            "mount": mount,
+            "mount_key": os.path.normpath(mount),
+            "fstype": v['entry'][2],
+            "fsoptions": v['entry'][3],
+            "dump": int(v['entry'][4]),
+            "pass": int(v['entry'][5]),
+        })
+    fstab_info = user_entries
+
+    # Index the existing entries by mount point, so we don't have to
+    # search the whole list for each entry in 'fstab'.
+    fstab_by_mount = {i['mount_key']: i for i in fstab_info}
 
     # Iterate over the provided list of mount points and see if they
     # match what the caller wants.
@@ -284,10 +336,8 @@ def main():
     change_args = []
 
     for fs in fstab:
-        # Find the fstab_info entry that corresponds to 'fs'. Note
-        # that this construct is "clever" (he said with disdain).
-        entry = next((i for i in fstab_info if i['mount'] == fs['mount']),
-                     None)
+        # Find the fstab_info entry that corresponds to 'fs'.
+        entry = fstab_by_mount.get(fs['mount'])
 
         if entry is None:
             if fs['state'] == 'absent':
@@ -307,14 +357,9 @@ def main():
                 "source": fs['src'],
                 "destination": fs['mount'],
             }
-            if "fstype" in fs:
-                args['fstype'] = fs['fstype']
-            if "options" in fs:
-                args['fsoptions'] = fs['options']
-            if "dump" in fs:
-                args['dump'] = fs['dump']
-            if "fsck_pass" in fs:
-                args['dump'] = fs['fsck_pass']
+            args.update({arg_key: fs[fs_key]
+                         for (fs_key, arg_key) in ADD_FIELDS
+                         if fs[fs_key] is not None})
 
             change_args.append(args)
 
@@ -330,11 +375,19 @@ def main():
             # This entry exists in the jail, and is supposed to. Make
             # sure it matches what the caller wants.
 
+            # Usually, nothing has changed, so check for that first.
+            have = (entry['source_key'], entry['fstype'], entry['fsoptions'],
+                    entry['dump'], entry['pass'])
+            want = (fs['src'], fs['fstype'], fs['options'],
+                    fs['dump'], fs['fsck_pass'])
+            if have == want:
+                continue
+
             # Collect a set of things to change about this mount point
             args = {}
 
             # Source
-            if entry['source'] != fs['src']:
+            if entry['source_key'] != fs['src']:
                 args['source'] = fs['src']
 
             # fstype
@@ -349,27 +402,29 @@ def main():
 
             # Dump
             if fs['dump'] is not None and \
-               int(entry['dump']) != fs['dump']:
+               entry['dump'] != fs['dump']:
                 args['dump'] = fs['dump']
 
             # fsck_pass
             if fs['fsck_pass'] is not None and \
-               int(entry['pass']) != fs['fsck_pass']:
+               entry['pass'] != fs['fsck_pass']:
                 args['pass'] = fs['fsck_pass']
 
             if len(args) > 0:
                 args['action'] = "REPLACE"
                 # Grr. For some reason, jail.fstab("REPLACE") demands
-                # index, source, and destination.
+                # index, source, and destination. Unless they're
+                # changing, give them as they are written in the file.
                 args['index'] = entry['index']
-                args['source'] = fs['src']
-                args['destination'] = fs['mount']
+                args.setdefault('source', entry['source'])
+                args['destination'] = entry['mount']
                 change_args.append(args)
 
-    if not append:
+    if not append and len(fstab_info) > 0:
         # Make a list of fstab_info items that don't appear in fstab.
-        listed_mounts = [m['mount'] for m in fstab]
-        extra_fses = [i for i in fstab_info if i['mount'] not in listed_mounts]
+        listed_mounts = {m['mount'] for m in fstab}
+        extra_fses = [i for i in fstab_info
+                      if i['mount_key'] not in listed_mounts]
 
         for entry in extra_fses:
             # For some reason, both source and destination are
@@ -380,47 +435,246 @@ def main():
                 "destination": entry['mount'],
             })
 
+    # If the same mount point was listed more than once in 'fstab',
+    # we may have queued the same change twice, and the second one
+    # would fail. Keep only the last change of each kind for each
+    # mount point.
+    change_args = list({(args['action'], args['destination']): args
+                        for args in change_args}.values())
+
+    # REPLACE identifies the entry to change by its index, and
+    # removing an entry shifts the index of every entry after it. So
+    # do all of the REPLACEs first, then the REMOVEs, then the ADDs.
+    # This also groups like changes together in the core.bulk job.
+    change_args.sort(key=lambda args: ACTION_ORDER[args['action']])
+
+    return (user_fstab, change_args)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=_ARGSPEC,
+        supports_check_mode=True,
+    )
+
+    result = dict(
+        changed=False,
+        msg='',
+        status=[]
+    )
+    if module.check_mode:
+        # List of changes being made
+        result['changes'] = []
+
+    # Assign variables from properties, for convenience
+    jail = module.params['jail']
+    fstab = module.params['fstab']
+    append = module.params['append']
+    iocroot = module.params['iocroot']
+
+    if len(fstab) == 0 and append:
+        # We've been asked to add nothing, and leave everything else
+        # alone. Nothing to do, so don't bother looking anything up.
+        module.exit_json(**result)
+
+    # Don't bother asking the middleware about a jail that can't
+    # exist.
+    if not valid_jail_name(jail):
+        module.fail_json(msg=f"Invalid jail name: {jail!r}")
+
+    # Normalize mount points and sources, so that "/data/" and
+    # "/data" are recognized as the same place.
+    for fs in fstab:
+        fs['mount'] = os.path.normpath(fs['mount'])
+        if fs['src'] is not None:
+            fs['src'] = os.path.normpath(fs['src'])
+
+    mw = MW.client()
+
+    # The fstab and iocage root may have been cached by an earlier
+    # task. Only look them up if they weren't.
+    iocroot_cache = FileCache("iocroot", ttl=IOCROOT_TTL)
+    fstab_cache = FileCache(f"jail_fstab-{jail}", ttl=FSTAB_TTL)
+    # Whether iocroot is a guess, rather than something the user or
+    # the middleware told us.
+    iocroot_cached = False
+    if iocroot is None:
+        iocroot = iocroot_cache.get()
+        iocroot_cached = iocroot is not None
+    if iocroot is None:
+        # This module runs on the NAS, so have a look around: if
+        # exactly one pool has an iocage dataset, that's almost
+        # certainly the active one. If there's more than one, ask
+        # the middleware.
+        candidates = glob.glob("/mnt/*/iocage")
+        if len(candidates) == 1 and os.path.isdir(candidates[0]):
+            iocroot = candidates[0]
+            iocroot_cached = True
+    fstab_info = fstab_cache.get()
+    fstab_cached = fstab_info is not None
+
+    # Look up the jail, its fstab, and the iocage root. These don't
+    # depend on each other, so do them all at once.
+    calls = [
+        # We only care about state for now.
+        ("jail.query", [[["id", "=", jail]], {"select": ["state"]}]),
+    ]
+    if fstab_info is None:
+        calls.append(("jail.fstab", [jail, {"action": "LIST"}]))
+    if iocroot is None:
+        # Get the root of the jail. We're going to need it in a second.
+        calls.append(("jail.get_iocroot", [], {"output": 'str'}))
+    results = call_multi(mw, calls)
+
+    jail_info = results.pop(0)
+    if fstab_info is None:
+        fstab_info = results.pop(0)
+        if not isinstance(fstab_info, Exception):
+            fstab_cache.set(fstab_info)
+    if iocroot is None:
+        iocroot = results.pop(0)
+        if not isinstance(iocroot, Exception):
+            iocroot_cache.set(iocroot)
+
+    # Check the jail first: if it doesn't exist, the other lookups
+    # will have failed as well, and that's less informative.
+    if isinstance(jail_info, Exception):
+        module.fail_json(msg=f"Error looking up jail {jail}: {jail_info}")
+    if len(jail_info) == 0:
+        # No such jail
+        module.fail_json(msg=f"No such jail {jail}")
+    # Jail exists
+    jail_info = jail_info[0]
+
+    if isinstance(fstab_info, Exception):
+        module.fail_json(msg=f"Error looking up jail {jail}: {fstab_info}")
+    if isinstance(iocroot, Exception):
+        module.fail_json(msg=f"Error looking up iocroot: {iocroot}")
+
+    jail_root = f"{iocroot}/jails/{jail}/root"
+
+    (result['fstab'], change_args) = \
+        plan_changes(fstab_info, fstab, append, jail_root)
+
+    if len(change_args) > 0 and (fstab_cached or iocroot_cached):
+        # The cached fstab and iocage root are good enough to tell
+        # that nothing needs to change, but not to make changes with:
+        # the jail may have been re-created, or its fstab edited,
+        # behind our back, and REPLACE identifies lines by index.
+        # Likewise, the active pool may have been switched, which
+        # moves the jail root. Get the real thing and start over.
+        calls = []
+        if fstab_cached:
+            fstab_cache.invalidate()
+            calls.append(("jail.fstab", [jail, {"action": "LIST"}]))
+        if iocroot_cached:
+            iocroot_cache.invalidate()
+            calls.append(("jail.get_iocroot", [], {"output": 'str'}))
+        results = call_multi(mw, calls)
+
+        if fstab_cached:
+            fstab_info = results.pop(0)
+            if isinstance(fstab_info, Exception):
+                module.fail_json(msg=f"Error looking up jail {jail}: "
+                                 f"{fstab_info}")
+        if iocroot_cached:
+            iocroot = results.pop(0)
+            if isinstance(iocroot, Exception):
+                module.fail_json(msg=f"Error looking up iocroot: {iocroot}")
+            iocroot_cache.set(iocroot)
+            jail_root = f"{iocroot}/jails/{jail}/root"
+
+        (result['fstab'], change_args) = \
+            plan_changes(fstab_info, fstab, append, jail_root)
+
     # If there are any changes, apply them.
     # If needed, stop the jail first and bring it up afterward.
     if len(change_args) > 0:
-        # Check the jail upness.
         result['changed'] = True
 
+        # The jail has to be down while its fstab is being changed:
+        # jail.fstab refuses anything but LIST on a running jail.
+        # If it's up, stop it first, and restart it afterward.
+        bounce_jail = jail_info['state'] == "up"
+
+        if module.check_mode:
+            # Just report what we would have done.
+            result['changes'] = \
+                (["shut down jail"] if bounce_jail else []) + \
+                change_args + \
+                (["restart jail"] if bounce_jail else [])
+            module.exit_json(**result)
+
         # Stop jail if necessary
-        if jail_info['state'] == "up":
-            # Need to shut down jail.
-            if module.check_mode:
-                result['changes'].append("shut down jail")
-            else:
-                try:
-                    mw.job("jail.stop", jail)
-                except Exception as e:
-                    module.fail_json(
-                        msg=f"Error shutting down jail {jail}: {e}")
+        if bounce_jail:
+            try:
+                mw.job("jail.stop", jail)
+            except Exception as e:
+                module.fail_json(
+                    msg=f"Error shutting down jail {jail}: {e}")
 
         # Apply the changes
-        for args in change_args:
-            if module.check_mode:
-                result['changes'].append(args)
-            else:
-                try:
-                    err = mw.call("jail.fstab", jail, args)
-                except Exception as e:
-                    module.fail_json(
-                        msg=f"Error modifying fstab with {args}: error {e}")
-                # XXX - What should the 'status' field be?
-                result['status'].append(err)
+
+        # Whatever happens, the cached fstab is out of date now.
+        fstab_cache.invalidate()
+
+        # Errors from making the changes. If anything goes wrong,
+        # we still want to restart the jail before failing, rather
+        # than leave it down.
+        errors = []
+
+        # Send all of the changes in one go, with core.bulk(). It
+        # returns a list of {"result": ..., "error": ...} objects, one
+        # for each change, in order.
+        try:
+            bulk_status = mw.job("core.bulk", "jail.fstab",
+                                 [[jail, args] for args in change_args])
+        except Exception as e:
+            # If this version of the middleware doesn't have
+            # core.bulk(), fall back to making the changes one at a
+            # time. But if core.bulk() failed for any other reason,
+            # some of the changes may already have been made, and
+            # none of them can safely be made twice.
+            if not _no_such_method(e):
+                errors.append(f"Error modifying fstab with {change_args}: "
+                              f"error {e}")
+            bulk_status = None
+
+        if bulk_status is None:
+            if len(errors) == 0:
+                for args in change_args:
+                    try:
+                        err = mw.call("jail.fstab", jail, args)
+                    except Exception as e:
+                        # Stop here: the remaining changes may depend
+                        # on this one.
+                        errors.append(
+                            f"Error modifying fstab with {args}: error {e}")
+                        break
+                    # XXX - What should the 'status' field be?
+                    result['status'].append(err)
+        else:
+            # core.bulk() doesn't stop at the first error: the changes
+            # after a failed one are still applied. So report on all
+            # of them.
+            for (args, status) in zip(change_args, bulk_status):
+                if status['error'] is not None:
+                    errors.append(f"Error modifying fstab with {args}: "
+                                  f"error {status['error']}")
+                result['status'].append(status['result'])
 
         # Start jail if it was up before
-        if jail_info['state'] == "up":
-            # Need to restart jail
-            if module.check_mode:
-                result['changes'].append("restart jail")
-            else:
-                try:
-                    mw.job("jail.start", jail)
-                except Exception as e:
-                    module.fail_json(msg=f"Error restarting jail {jail}: {e}")
+        if bounce_jail:
+            try:
+                mw.job("jail.start", jail)
+            except Exception as e:
+                errors.append(f"Error restarting jail {jail}: {e}")
+
+        if len(errors) > 0:
+            # Some of the changes may have been made, so report
+            # those, too.
+            result['msg'] = "; ".join(errors)
+            module.fail_json(**result)
 
     module.exit_json(**result)
 
@@ -8,6 +8,10 @@ short_description: Configure jail system
 description:
   - Configure the jail system. Some of this overlaps with the plugin system.
   - Does not configure individual jails. For that, see C(jail).
+  - To save time, the active pool is cached on the TrueNAS host for
+    ten minutes. If the cache says the requested pool is already
+    active, the module does not check with the middleware. Set the
+    environment variable C(truenas_cache) to C(no) to turn this off.
 options:
   pool:
     description:
@@ -24,6 +28,11 @@ EXAMPLES = '''
 
 # XXX
 RETURN = '''
+active_pool:
+  description:
+    - The pool that was active before any changes were made.
+    - Only returned if C(pool) was given.
+  type: str
 status:
   description: True iff pool activation was successful.
   type: bool
@@ -33,13 +42,23 @@ status:
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.arensb.truenas.plugins.module_utils.middleware \
     import MiddleWare as MW
+from ansible_collections.arensb.truenas.plugins.module_utils.cache \
+    import FileCache
+
+# How long to remember the active pool, in seconds. This module
+# updates the cache whenever it activates a pool, but it can also be
+# changed from the web UI, so don't trust it for too long.
+ACTIVE_POOL_TTL = 10 * 60
+
+# Module arguments. These never change, so build them once.
+_ARGSPEC = dict(
+    pool=dict(type='str'),
+)
 
 
 def main():
     module = AnsibleModule(
-        argument_spec=dict(
-            pool=dict(type='str'),
-            ),
+        argument_spec=_ARGSPEC,
         supports_check_mode=True,
     )
 
@@ -48,11 +67,24 @@ def main():
         msg=''
     )
 
-    mw = MW.client()
-
     # Assign variables from properties, for convenience
     pool = module.params['pool']
 
+    if pool is None:
+        # There's nothing to configure, so don't bother looking
+        # anything up.
+        module.exit_json(**result)
+
+    # If an earlier task found that the right pool is already active,
+    # there's nothing to do, and no need to talk to the middleware at
+    # all.
+    pool_cache = FileCache("jail_active_pool", ttl=ACTIVE_POOL_TTL)
+    if pool_cache.get() == pool:
+        result['active_pool'] = pool
+        module.exit_json(**result)
+
+    mw = MW.client()
+
     # Look up which pool is currently activated.
     try:
         active_pool = mw.call("jail.get_activated_pool",
@@ -60,6 +92,7 @@ def main():
     except Exception as e:
         module.fail_json(msg=f"Error looking up active pool: {e}")
     result['active_pool'] = active_pool
+    pool_cache.set(active_pool)
 
     # Make list of differences between what is and what should
     # be.
@@ -68,7 +101,7 @@ def main():
     # update this.
     result['changed'] = False
 
-    if pool is not None and active_pool != pool:
+    if active_pool != pool:
         #
         # Update the active pool
         #
@@ -86,6 +119,12 @@ def main():
                 module.fail_json(msg=f"Error activating pool {pool}: "
                                  f"err == {err}")
 
+            # The iocage root and the jails live on the active pool,
+            # so whatever other modules have cached is now wrong.
+            pool_cache.set(pool)
+            FileCache("iocroot").invalidate()
+            FileCache.invalidate_prefix("jail_fstab-")
+
         result['changed'] = True
 
     # In principle, other things could be changed. Put them here.
@@ -37,11 +37,12 @@ options:
   port:
     description:
       - The TCP port on which to connect to the outgoing mail server.
+      - If any other option is given, this defaults to C(25).
     type: int
-    default: 25
   security:
     description:
       - The encryption to use for outgoing mail.
+      - If any other option is given, this defaults to C(PLAIN).
     type: str
     choices: [ PLAIN, SSL, TLS ]
   smtp:
@@ -81,6 +82,31 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.arensb.truenas.plugins.module_utils.middleware \
     import MiddleWare as MW
 
+# Defaults for 'port' and 'security', if anything else is configured.
+DEFAULT_PORT = 25
+DEFAULT_SECURITY = "PLAIN"
+
+# Maps module options to the corresponding fields in mail.config()
+# and mail.update(). The oauth options are nested, so they're handled
+# separately.
+FIELD_MAP = (
+    ("from_name", "fromname"),
+    ("from_email", "fromemail"),
+    ("server", "outgoingserver"),
+    ("port", "port"),
+    ("security", "security"),
+    ("smtp", "smtp"),
+    ("smtp_user", "user"),
+    ("smtp_password", "pass"),
+)
+
+# Same as FIELD_MAP, but for the fields of the 'oauth' dict.
+OAUTH_FIELD_MAP = (
+    ("oauth_id", "client_id"),
+    ("oauth_secret", "client_secret"),
+    ("oauth_token", "refresh_token"),
+)
+
 
 def main():
     module = AnsibleModule(
@@ -88,8 +114,8 @@ def main():
             from_name=dict(type='str'),
             from_email=dict(type='str'),
             server=dict(type='str'),
-            port=dict(type='int', default=25),
-            security=dict(type='str', default='PLAIN',
+            port=dict(type='int'),
+            security=dict(type='str',
                           choices=["PLAIN", "SSL", "TLS"]),
             smtp=dict(type='bool'),
             smtp_user=dict(type='str'),
@@ -107,22 +133,28 @@ def main():
         msg=''
     )
 
+    # The options are handled through FIELD_MAP and OAUTH_FIELD_MAP,
+    # below.
+    params = module.params
+
+    if all(v is None for v in params.values()):
+        # Nothing to configure, so don't bother looking anything up.
+        module.exit_json(**result)
+
+    # 'port' and 'security' don't have defaults in the argument spec,
+    # so that we can tell whether anything was given at all. But if
+    # anything was, they have always defaulted to port 25, plaintext.
+    if params['port'] is None:
+        params['port'] = DEFAULT_PORT
+    if params['security'] is None:
+        params['security'] = DEFAULT_SECURITY
+
     mw = MW.client()
 
-    # Assign variables from properties, for convenience
-    from_name = module.params['from_name']
-    from_email = module.params['from_email']
-    server = module.params['server']
-    port = module.params['port']
-    security = module.params['security']
-    smtp = module.params['smtp']
-    smtp_user = module.params['smtp_user']
-    smtp_password = module.params['smtp_password']
-    oauth_id = module.params['oauth_id']
-    oauth_secret = module.params['oauth_secret']
-    oauth_token = module.params['oauth_token']
-
-    # Look up the configuration
+    # Look up the configuration. This isn't cached, the way other
+    # modules cache their configuration, because it includes the SMTP
+    # password and OAuth secrets, and those shouldn't be written to
+    # disk.
     try:
         mail_info = mw.call("mail.config")
     except Exception as e:
@@ -130,45 +162,22 @@ def main():
 
     # Make list of differences between what is and what should
     # be.
-    arg = {}
-
-    if from_name is not None and mail_info['fromname'] != from_name:
-        arg['fromname'] = from_name
-    if from_email is not None and mail_info['fromemail'] != from_email:
-        arg['fromemail'] = from_email
-    if server is not None and mail_info['outgoingserver'] != server:
-        arg['outgoingserver'] = server
-    if port is not None and mail_info['port'] != port:
-        arg['port'] = port
-    if security is not None and mail_info['security'] != security:
-        arg['security'] = security
-    if smtp is not None and mail_info['smtp'] != smtp:
-        arg['smtp'] = smtp
-    if smtp_user is not None and mail_info['user'] != smtp_user:
-        arg['user'] = smtp_user
-    if smtp_password is not None and mail_info['pass'] != smtp_password:
-        arg['pass'] = smtp_password
-    if oauth_id is not None and (
-            'client_id' not in mail_info['oauth'] or
-            mail_info['oauth']['client_id'] != oauth_id
-    ):
-        if 'oauth' not in arg:
-            arg['oauth'] = {}
-        arg['oauth']['client_id'] = oauth_id
-    if oauth_secret is not None and (
-            'client_secret' not in mail_info['oauth'] or
-            mail_info['oauth']['client_secret'] != oauth_secret
-    ):
-        if 'oauth' not in arg:
-            arg['oauth'] = {}
-        arg['oauth']['client_secret'] = oauth_secret
-    if oauth_token is not None and (
-            'refresh_token' not in mail_info['oauth'] or
-            mail_info['oauth']['refresh_token'] != oauth_token
-    ):
-        if 'oauth' not in arg:
-            arg['oauth'] = {}
-        arg['oauth']['refresh_token'] = oauth_token
+    arg = {
+        key: params[opt]
+        for (opt, key) in FIELD_MAP
+        if params[opt] is not None and mail_info.get(key) != params[opt]
+    }
+
+    # The OAuth settings are a dict of their own, which may be empty
+    # or missing if OAuth was never configured.
+    cur_oauth = mail_info.get('oauth') or {}
+    oauth_diff = {
+        key: params[opt]
+        for (opt, key) in OAUTH_FIELD_MAP
+        if params[opt] is not None and cur_oauth.get(key) != params[opt]
+    }
+    if oauth_diff:
+        arg['oauth'] = oauth_diff
 
     # If there are any changes, mail.update()
     if len(arg) == 0:
@@ -23,16 +23,10 @@ options:
   protocols:
     description:
       - List of supported protocols. The elements are any of
-        `nfsv3`, `nfsv4` or their synonyms.
+        `nfsv3`, `nfsv4` or their synonyms: C(NFSv3), C(NFSV3), C(v3),
+        C(V3), C(NFSv4), C(NFSV4), C(v4), C(V4).
     type: list
     elements: str
-    choices:
-      - nfsv3
-      - nfsv4
-      - NFSv3
-      - NFSv4
-      - v3
-      - v4
   nfsv4:
     description:
       - If true, enable NFSv4. Otherwise, use NFSv3.
@@ -63,6 +57,8 @@ options:
     description:
       - List of IP addresses on which to listen for NFS requests.
         When this is the empty list, listen on all available addresses.
+      - The order of the addresses is not significant, so reordering
+        the list does not count as a change.
     type: list
     elements: str
   mountd_port:
@@ -176,7 +172,55 @@ status:
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.arensb.truenas.plugins.module_utils.middleware \
-    import MiddleWare as MW
+    import MiddleWare as MW, cached_call, invalidate_call
+
+# Table of acceptable synonyms for the protocol names:
+# nfsvN, NFSvN, NFSVN, vN, VN.
+# It maps them to the values to pass to the middleware: NFSV3, NFSV4.
+PROTOCOL_NAMES = {
+    "nfsv3": "NFSV3",   "nfsv4": "NFSV4",
+    "NFSv3": "NFSV3",   "NFSv4": "NFSV4",
+    "NFSV3": "NFSV3",   "NFSV4": "NFSV4",
+    "v3": "NFSV3",      "v4": "NFSV4",
+    "V3": "NFSV3",      "V4": "NFSV4",
+}
+
+# The sets of protocols that can be expressed with a single v4
+# toggle, as on TrueNAS CORE.
+PROTOCOLS_V3 = frozenset(("NFSV3",))
+PROTOCOLS_V3_V4 = frozenset(("NFSV3", "NFSV4"))
+
+# Maps module options to the corresponding fields in nfs.config() and
+# nfs.update(), for the options that can be compared directly. The
+# protocol options and 'bindip' need more work, so they're handled
+# separately.
+FIELD_MAP = (
+    ("servers", "servers"),
+    ("udp", "udp"),
+    ("allow_nonroot", "allow_nonroot"),
+    ("krb", "v4_krb"),
+    ("domain", "v4_domain"),
+    ("mountd_port", "mountd_port"),
+    ("rpcstatd_port", "rpcstatd_port"),
+    ("rpclockd_port", "rpclockd_port"),
+    ("userd_manage_gids", "userd_manage_gids"),
+    ("mountd_log", "mountd_log"),
+    ("statd_lockd_log", "statd_lockd_log"),
+)
+
+
+def _protocol_name(value):
+    """Argument type for the elements of 'protocols'.
+
+    Checks that 'value' is one of the synonyms in PROTOCOL_NAMES, and
+    returns the corresponding name that the middleware uses, so that
+    validating and normalizing each element is a single lookup.
+    """
+    try:
+        return PROTOCOL_NAMES[value]
+    except KeyError:
+        raise ValueError(f"Unknown protocol {value!r}. Must be one of: "
+                         f"{', '.join(PROTOCOL_NAMES)}")
 
 
 def main():
@@ -186,9 +230,7 @@ def main():
             udp=dict(type='bool'),
             allow_nonroot=dict(type='bool'),
             nfsv4=dict(type='bool'),
-            protocols=dict(type='list', elements='str',
-                           choices=['nfsv3', 'NFSv3', 'NFSV3', 'v3', 'V3',
-                                    'nfsv4', 'NFSv4', 'NFSV4', 'v4', 'V4']),
+            protocols=dict(type='list', elements=_protocol_name),
             v3owner=dict(type='bool'),
             krb=dict(type='bool'),
             domain=dict(type='str'),
@@ -211,39 +253,19 @@ def main():
         msg=''
     )
 
-    mw = MW.client()
+    # Assign variables from properties, for convenience. Most of them
+    # are handled through FIELD_MAP, below.
+    # XXX - v3owner is accepted, but not implemented yet.
+    params = module.params
+    nfsv4 = params['nfsv4']
+    protocols = params['protocols']
+    bindip = params['bindip']
 
-    # Assign variables from properties, for convenience
-    servers = module.params['servers']
-    udp = module.params['udp']
-    allow_nonroot = module.params['allow_nonroot']
-    nfsv4 = module.params['nfsv4']
-    protocols = module.params['protocols']
-    v3owner = module.params['v3owner']
-    krb = module.params['krb']
-    domain = module.params['domain']
-    bindip = module.params['bindip']
-    mountd_port = module.params['mountd_port']
-    rpcstatd_port = module.params['rpcstatd_port']
-    rpclockd_port = module.params['rpclockd_port']
-    userd_manage_gids = module.params['userd_manage_gids']
-    mountd_log = module.params['mountd_log']
-    statd_lockd_log = module.params['statd_lockd_log']
-
-    # XXX - Debugging
-    result['nfsv4'] = nfsv4
-    result['protocols'] = protocols
-
-    # Add a table of acceptable synonyms for the protocol names.
-    # nfsvN, NFSvN, NFSVN, vN, VN.
-    # Make it a dict that maps to the values to pass to midclt: NFSV3, NFSV4.
-    protocol_names = {
-        "nfsv3": "NFSV3",	"nfsv4": "NFSV4",
-        "NFSv3": "NFSV3",	"NFSv4": "NFSV4",
-        "NFSV3": "NFSV3",	"NFSV4": "NFSV4",
-        "v3": "NFSV3",  	"v4": "NFSV4",
-        "V3": "NFSV3",          "V4": "NFSV4",
-    }
+    if all(v is None for v in params.values()):
+        # Nothing to configure, so don't bother looking anything up.
+        module.exit_json(**result)
+
+    mw = MW.client()
 
     # Get the list of protocols that we want. "None" means leave
     # the list alone, whatever it's currently set to. Otherwise, it's
@@ -253,16 +275,17 @@ def main():
     # you from doing stupid things.)
     want_protocols = None
     if protocols is not None:
-        want_protocols = set([protocol_names[i] for i in protocols])
+        # _protocol_name() has already mapped these to the
+        # middleware's names.
+        want_protocols = frozenset(protocols)
     elif nfsv4 is not None:
         if nfsv4:
-            want_protocols = set(["NFSV3", "NFSV4"])
+            want_protocols = PROTOCOLS_V3_V4
         else:
-            want_protocols = set(["NFSV3"])
-    # XXX - Debugging
-    result['want_protocols'] = want_protocols
+            want_protocols = PROTOCOLS_V3
+
     try:
-        nfs_info = mw.call("nfs.config")
+        nfs_info = cached_call(mw, "nfs.config")
     except Exception as e:
         module.fail_json(msg=f"Error looking up nfs configuration: {e}")
 
@@ -274,17 +297,11 @@ def main():
 
     # Make list of differences between what is and what should
 
-    arg = {}
-
-    if servers is not None and nfs_info['servers'] != servers:
-        arg['servers'] = servers
-
-    if udp is not None and nfs_info['udp'] is not udp:
-        arg['udp'] = udp
-
-    if allow_nonroot is not None and nfs_info['allow_nonroot'] \
-       is not allow_nonroot:
-        arg['allow_nonroot'] = allow_nonroot
+    arg = {
+        key: params[opt]
+        for (opt, key) in FIELD_MAP
+        if params[opt] is not None and nfs_info.get(key) != params[opt]
+    }
 
     if want_protocols is not None:
         # The user cares which protocols are enabled.
@@ -292,18 +309,15 @@ def main():
         if not use_protocols:
             # If you only have a v4 toggle, you're getting v3 whether you
             # want it or not.
-            want_protocols.add("NFSV3")
+            want_protocols |= PROTOCOLS_V3
 
         if 'v4' in nfs_info:
             # This version of TrueNAS uses 'v4'.
-            have_protocols = set(['NFSV3', 'NFSV4']) \
-                if nfs_info['v4'] else set(['NFSV3'])
+            have_protocols = PROTOCOLS_V3_V4 \
+                if nfs_info['v4'] else PROTOCOLS_V3
         else:
             # This version of TrueNAS uses 'protocols'
-            have_protocols = set(nfs_info['protocols'])
-
-        # XXX - Debugging
-        result['have_protocols'] = have_protocols
+            have_protocols = frozenset(nfs_info['protocols'])
 
         if have_protocols != want_protocols:
             if use_protocols:
@@ -317,38 +331,19 @@ def main():
                 # way to turn off v3.
                 arg['v4'] = 'NFSV4' in want_protocols
 
+    if bindip is not None:
+        # Drop any duplicate addresses, e.g., from merging lists in
+        # Jinja, but keep the order the user gave.
+        bindip = list(dict.fromkeys(bindip))
 
-    if krb is not None and nfs_info['v4_krb'] is not krb:
-        arg['v4_krb'] = krb
-
-    if domain is not None and nfs_info['v4_domain'] != domain:
-        arg['v4_domain'] = domain
-
-    if bindip is not None and \
-       set(bindip) != set(nfs_info['bindip']):
-        arg['bindip'] = bindip
-
-    if mountd_port is not None and nfs_info['mountd_port'] != mountd_port:
-        arg['mountd_port'] = mountd_port
-
-    if rpcstatd_port is not None and \
-       nfs_info['rpcstatd_port'] != rpcstatd_port:
-        arg['rpcstatd_port'] = rpcstatd_port
-
-    if rpclockd_port is not None and \
-       nfs_info['rpclockd_port'] != rpclockd_port:
-        arg['rpclockd_port'] = rpclockd_port
-
-    if userd_manage_gids is not None and \
-       nfs_info['userd_manage_gids'] is not userd_manage_gids:
-        arg['userd_manage_gids'] = userd_manage_gids
-
-    if mountd_log is not None and nfs_info['mountd_log'] is not mountd_log:
-        arg['mountd_log'] = mountd_log
-
-    if statd_lockd_log is not None and \
-       nfs_info['statd_lockd_log'] is not statd_lockd_log:
-        arg['statd_lockd_log'] = statd_lockd_log
+        # nfsd listens on every address given, in no particular
+        # order, so compare these as sets. The middleware may return
+        # null rather than an empty list when listening on all
+        # addresses.
+        want_bindip = frozenset(bindip)
+        have_bindip = frozenset(nfs_info['bindip'] or ())
+        if want_bindip != have_bindip:
+            arg['bindip'] = bindip
 
     # If there are any changes, nfs.update()
     if len(arg) == 0:
@@ -361,6 +356,9 @@ def main():
         if module.check_mode:
             result['msg'] = f"Would have updated nfs: {arg}"
         else:
+            # Whatever happens, the cached configuration is about to
+            # be out of date.
+            invalidate_call("nfs.config")
             try:
                 err = mw.call("nfs.update",
                               arg)
@@ -376,5 +374,3 @@ def main():
 # Main
 if __name__ == "__main__":
     main()
-if __name__ == "__main__":
-    main()
@@ -38,6 +38,12 @@ module: plugin
 short_description: Manage plugins.
 description:
   - Install, remove, and manage TrueNAS plugins.
+  - To save time, the list of plugin repositories and the list of
+    plugins in each one are cached on the TrueNAS host for an hour.
+    Likewise, the fact that a plugin does not exist is remembered for
+    five minutes, so that making sure it is absent again doesn't need
+    to look it up. Set the environment variable C(truenas_cache) to
+    C(no) to turn this off.
 options:
   enabled:
     description:
@@ -157,7 +163,19 @@ plugin:
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.arensb.truenas.plugins.module_utils.middleware \
-    import MiddleWare as MW
+    import MiddleWare as MW, cached_call, call_multi, \
+    invalidate_call
+from ansible_collections.arensb.truenas.plugins.module_utils.cache \
+    import FileCache
+
+# How long to cache the list of repositories, and the list of plugins
+# in each one, in seconds. These only change when the repositories
+# themselves are updated.
+REPO_TTL = 60 * 60
+
+# How long to remember that a plugin doesn't exist, in seconds. It
+# might be created behind our back, so keep this short.
+ABSENT_TTL = 5 * 60
 
 
 def main():
@@ -180,16 +198,16 @@ def main():
             # Look up the list of repositories, and try to find one
             # with the name we need.
             try:
-                repositories = mw.call("plugin.official_repositories")
+                repositories = cached_call(mw, "plugin.official_repositories",
+                                           ttl=REPO_TTL)
             except Exception as e:
                 module.fail_json(msg=f"Error looking up repositories: {e}")
 
-            for key, repo in repositories.items():
-                if repo['name'] == repository:
-                    # Found it.
-                    repository_url = repo['git_repository']
-                    break
-            else:
+            repository_url = next((repo['git_repository']
+                                   for repo in repositories.values()
+                                   if repo['name'] == repository),
+                                  None)
+            if repository_url is None:
                 module.fail_json(msg=f"No repository named {repository}")
 
         # Second step. We have a repo URL.
@@ -197,17 +215,17 @@ def main():
         if plugin_id is None:
             # Get list of packages in the repo.
             try:
-                pkgs = mw.job("plugin.available",
-                              {"plugin_repository": repository_url})
+                pkgs = cached_call(mw, "plugin.available",
+                                   {"plugin_repository": repository_url},
+                                   ttl=REPO_TTL, job=True)
             except Exception as e:
                 module.fail_json(msg=f"Error looking up packages in repository {repository_url}: {e}")
 
             # Look up plugin by name
-            for pkg in pkgs:
-                if pkg['name'] == plugin:
-                    plugin_id = pkg['plugin']
-                    break
-            else:
+            plugin_id = next((pkg['plugin'] for pkg in pkgs
+                              if pkg['name'] == plugin),
+                             None)
+            if plugin_id is None:
                 module.fail_json(msg=f"No package named {plugin} in repository {repository_url}")
 
         return (repository_url, plugin_id)
@@ -219,46 +237,56 @@ def main():
 
         nonlocal module, plugin_id, plugin, result
 
-        # XXX - I think that if the plugin_id is given, that's all we
-        # need: we can save time and let the middleware do the lookup.
-
         # Get list of known repositories.
         try:
-            repositories = mw.call("plugin.official_repositories")
+            repositories = cached_call(mw, "plugin.official_repositories",
+                                       ttl=REPO_TTL)
         except Exception as e:
             module.fail_json(msg=f"Error looking up repositories: {e}")
 
-        for key, repo in repositories.items():
-            # Get the packages in this repo
-            repo_url = repo['git_repository']
+        # Build indexes of every package in every repository, mapping
+        # the package name, and the plugin ID, to (repo URL, plugin
+        # ID). If the same name or ID appears in more than one
+        # repository, the first one wins.
+        #
+        # Each repository's package list is a separate, possibly slow,
+        # job, so fetch them all at once.
+        repos = list(repositories.values())
+        all_packages = call_multi(
+            mw,
+            [("plugin.available",
+              [{"plugin_repository": repo['git_repository']}])
+             for repo in repos],
+            job=True, ttl=REPO_TTL)
+
+        by_name = {}
+        by_id = {}
+        errors = []
+        for repo, packages in zip(repos, all_packages):
+            if isinstance(packages, Exception):
+                # Don't give up yet: the plugin may well be in one of
+                # the other repositories.
+                errors.append("Error looking up packages in "
+                              f"repo {repo['name']}: {packages}")
+                continue
 
-            # Get list of packages in this repo.
-            try:
-                packages = mw.job("plugin.available",
-                                  {"plugin_repository":
-                                   repo['git_repository']})
-            except Exception as e:
-                module.fail_json(msg="Error looking up packages in "
-                                 f"repo {repo['name']}: {e}")
-
-            # Look for the package in this repo
             for pkg in packages:
-                if plugin_id is None:
-                    # Look by name
-                    if pkg['name'] == plugin:
-                        # Found it
-                        return (repo_url, pkg['plugin'])
-                else:
-                    # Look by ID
-                    if pkg['plugin'] == plugin_id:
-                        # Found it
-                        return (repo_url, pkg['plugin'])
+                found = (repo['git_repository'], pkg['plugin'])
+                by_name.setdefault(pkg['name'], found)
+                by_id.setdefault(pkg['plugin'], found)
+
+        # Look up by ID if we have one, otherwise by name.
+        if plugin_id is not None:
+            (index, key) = (by_id, plugin_id)
         else:
-            module.fail_json(msg="Can't find package "
-                             f"{plugin if plugin_id is None else plugin_id}"
-                             " in any repository.")
+            (index, key) = (by_name, plugin)
 
-        module.fail_json(msg="Should never get this far.")
+        if key not in index:
+            if errors:
+                module.fail_json(msg="; ".join(errors))
+            module.fail_json(msg=f"Can't find package {key}"
+                             " in any repository.")
+        return index[key]
 
     module = AnsibleModule(
         argument_spec=dict(
@@ -297,8 +325,6 @@ def main():
         msg=''
     )
 
-    mw = MW.client()
-
     # Assign variables from properties, for convenience
     name = module.params['name']
     plugin = module.params['plugin']
@@ -308,10 +334,22 @@ def main():
     repository_url = module.params['repository_url']
     enabled = module.params['enabled']
 
-    # Look up the plugin
+    # Remember plugins that we know don't exist, so that making sure
+    # a plugin is absent, again, doesn't have to ask the middleware.
+    absent_cache = FileCache(f"plugin_absent-{name}", ttl=ABSENT_TTL)
+    if state == 'absent' and absent_cache.get():
+        module.exit_json(**result)
+
+    mw = MW.client()
+
+    # Look up the plugin. We only need its ID, and whether its jail
+    # is running. Listing plugins is slow enough as it is, so don't
+    # ask for the rest.
     try:
         plugin_info = mw.call("plugin.query",
-                              [["name", "=", name]])
+                              [["name", "=", name]],
+                              {"select": ["id", "jid", "name"],
+                               "limit": 1})
         if len(plugin_info) == 0:
             # No such plugin
             plugin_info = None
@@ -376,9 +414,15 @@ def main():
                 #
                 # Create new plugin
                 #
+                absent_cache.invalidate()
                 try:
                     err = mw.job("plugin.create", arg)
                 except Exception as e:
+                    # Maybe the plugin list we used was out of date.
+                    # Make sure the next attempt fetches it again.
+                    if repository_url is not None:
+                        invalidate_call("plugin.available",
+                                        {"plugin_repository": repository_url})
                     result['failed_invocation'] = arg
                     module.fail_json(msg=f"Error creating plugin {name}: {e}")
 
@@ -390,6 +434,7 @@ def main():
         else:
             # Plugin is not supposed to exist.
             # All is well
+            absent_cache.set(True)
             result['changed'] = False
 
     else:
@@ -445,6 +490,7 @@ def main():
                                   plugin_info['id'])
                 except Exception as e:
                     module.fail_json(msg=f"Error deleting plugin {name}: {e}")
+                absent_cache.set(True)
             result['changed'] = True
 
     module.exit_json(**result)
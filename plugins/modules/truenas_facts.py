@@ -154,6 +154,13 @@ ansible_facts.truenas_system_info:
     "system_manufacturer": "To be filled by O.E.M.",
     "ecc_memory": false
   }
+ansible_facts.truenas_iocroot:
+  description:
+    - The root of the iocage directory tree, where jails and plugins
+      live.
+    - Only returned on systems that support jails.
+  type: str
+  sample: /mnt/pool0/iocage
 ansible_facts.truenas_build_time:
   description:
     - The system build time, when the OS was built.
@@ -253,6 +260,14 @@ def main():
         result['msg'] = f"Error looking up facts: {e}"
         module.exit_json(**result)
 
+    # Not every system has jails, so it's not an error if we can't
+    # find the iocage root.
+    try:
+        result['ansible_facts']['truenas_iocroot'] = \
+            mw.call("jail.get_iocroot", output='str')
+    except Exception:
+        pass
+
     module.exit_json(**result)
 
 